@@ -0,0 +1,69 @@
+# ECA = Evidence Checker Automation
+# Load test for the local grading service started with:
+#   python "python_code_version [ECA[2025-07-07]].py" serve [port] [workers]
+# Usage:
+#   python ECA_load_test.py path/to/workbook.xlsx -n 200 -c 8
+#   python ECA_load_test.py path/to/workbook.xlsx --upload    (send the bytes instead of the path)
+
+import argparse
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+def post_once(url: str, body: bytes, headers: Dict[str, str]) -> Tuple[float, int]:
+    request = urllib.request.Request(url, data=body, headers=headers, method="POST")
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=300) as response:
+            json.loads(response.read())
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except urllib.error.URLError:
+        status = 0
+    return time.perf_counter() - start, status
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load test the ECA grading service.")
+    parser.add_argument("workbook", type=Path, help="Excel workbook to submit")
+    parser.add_argument("--url", default="http://127.0.0.1:8765/analyse")
+    parser.add_argument("-n", "--requests", type=int, default=100, help="total requests")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="requests in flight")
+    parser.add_argument("--upload", action="store_true", help="upload the workbook bytes instead of posting its path")
+    args = parser.parse_args()
+
+    if args.upload:
+        body = args.workbook.read_bytes()
+        # The service picks the temp-file suffix (and so the reader) from X-Filename.
+        headers = {"Content-Type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                   "X-Filename": args.workbook.name}
+    else:
+        body = json.dumps({"path": str(args.workbook.resolve())}).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(lambda _: post_once(args.url, body, headers), range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency * 1000 for latency, status in results if status == 200]
+    failures = len(results) - len(latencies)
+    print(f"Requests: {len(results)}  concurrency: {args.concurrency}  failed: {failures}")
+    print(f"Wall time: {elapsed:.2f} s  throughput: {len(results) / elapsed:.1f} req/s")
+    if latencies:
+        print(f"Latency ms  mean: {statistics.mean(latencies):.1f}  p50: {percentile(latencies, 50):.1f}  "
+              f"p95: {percentile(latencies, 95):.1f}  p99: {percentile(latencies, 99):.1f}  max: {max(latencies):.1f}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
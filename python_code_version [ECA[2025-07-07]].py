@@ -2,74 +2,377 @@
 # ECA = Evidence Checker Automation
 
 import sys
+import copy
 import uuid
 import platform
 import socket
+import signal
 import time
 import logging
 import tkinter as tk
 from tkinter import filedialog, ttk
 import tkinter.font as tkfont
 from pathlib import Path
+from datetime import date
 import logging
 from dataclasses import dataclass
-from typing import List, Tuple, Optional, Dict
+from typing import List, Tuple, Optional, Dict, Set
 import re
 import os
-
+import io
+import json
+import queue
+import multiprocessing
+import tempfile
+import zipfile
+import posixpath
+import importlib.util
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+import numpy as np # installed with pandas
 import pandas as pd # Pandas >= 1.2.0 
 import openpyxl # and Openpyxl >= 3.0.0.
 from openpyxl import load_workbook
 from openpyxl.utils import column_index_from_string, get_column_letter, range_boundaries
 
-logging.basicConfig(filename="my_log_file.log", level=logging.DEBUG, format="%(asctime)s %(levelname)s:%(message)s")
 logger = logging.getLogger(__name__)
 check_counts: Dict[str, int] = {}
 
 EXPECTED_TOTAL_SALES = 7_777_460_207
 
+LOG_FILE = "my_log_file.log"
+LOG_FORMAT = "%(asctime)s %(levelname)s:%(message)s"
+LOG_MAX_BYTES = 5 * 1024 * 1024 # rotate the log once it reaches 5 MB
+LOG_BACKUP_COUNT = 3 # keep my_log_file.log.1 .. .3
+
+class RunIdFilter(logging.Filter):
+    # Stamps every record with the current run_id so JSON lines can be grouped per run.
+    run_id = "-"
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.run_id = self.run_id
+        return True
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"ts": self.formatTime(record),
+                 "level": record.levelname,
+                 "run_id": getattr(record, "run_id", "-"),
+                 "logger": record.name,
+                 "message": record.getMessage()}
+        exc = self.formatException(record.exc_info) if record.exc_info else record.exc_text
+        if exc:
+            entry["exc"] = exc
+        return json.dumps(entry, default=str)
+
+class TracebackQueueHandler(QueueHandler):
+    # QueueHandler.prepare folds the traceback into the message and drops exc_info;
+    # keep the message bare and carry the traceback as exc_text so each formatter places it.
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+        prepared = copy.copy(record)
+        prepared.message = prepared.msg = record.getMessage()
+        prepared.args = None
+        prepared.exc_info = None
+        prepared.exc_text = exc_text
+        return prepared
+
+run_id_filter = RunIdFilter()
+
+def setup_logging(json_lines: bool = False, level: int = logging.DEBUG, filename: str = LOG_FILE) -> QueueListener:
+    # The calling thread only puts records on a queue; the listener thread does the file I/O and rotation.
+    file_handler = RotatingFileHandler(filename, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    file_handler.setFormatter(JsonLinesFormatter() if json_lines else logging.Formatter(LOG_FORMAT))
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    queue_handler = TracebackQueueHandler(log_queue)
+    queue_handler.addFilter(run_id_filter)
+    root_logger = logging.getLogger()
+    root_logger.setLevel(level)
+    root_logger.addHandler(queue_handler)
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+def start_worker_logging() -> Tuple["multiprocessing.Queue[logging.LogRecord]", QueueListener]:
+    # Worker processes put records on a multiprocessing queue; this listener hands them to the
+    # parent's own handlers, so they reach the same log file stamped with the parent's run_id.
+    worker_queue: "multiprocessing.Queue[logging.LogRecord]" = multiprocessing.Queue(-1)
+    listener = QueueListener(worker_queue, *logging.getLogger().handlers, respect_handler_level=True)
+    listener.start()
+    return worker_queue, listener
+
 def log_startup(config):
     start_ts = time.time()
     run_id = uuid.uuid4()
+    run_id_filter.run_id = str(run_id)
     logger.info("="*40)  # unique identifier
-    logger.info(f"Run ID: {run_id}")  # unique identifier
-    logger.info(f"Startup timestamp: {start_ts}")  # epoch start time
+    logger.info("Run ID: %s", run_id)  # unique identifier
+    logger.info("Startup timestamp: %s", start_ts)  # epoch start time
     # Python and dependency versions
-    logger.info(f"Python version: {platform.python_version()}")
-    logger.info(f"pandas version: {pd.__version__}")
-    logger.info(f"openpyxl version: {openpyxl.__version__}")
+    logger.info("Python version: %s", platform.python_version())
+    logger.info("pandas version: %s", pd.__version__)
+    logger.info("openpyxl version: %s", openpyxl.__version__)
     # OS and hostname
-    logger.info(f"Hostname: {socket.gethostname()}")
+    logger.info("Hostname: %s", socket.gethostname())
     # Configuration settings and selection method
     logger.info(
-        f"Config: dark_mode={config.dark_mode}, choice={config.choice}, "
-        f"show_info={config.show_info}, show_ok={config.show_ok}, show_errors={config.show_errors}")
+        "Config: dark_mode=%s, choice=%s, show_info=%s, show_ok=%s, show_errors=%s, log_json=%s, log_level=%s",
+        config.dark_mode, config.choice, config.show_info, config.show_ok, config.show_errors,
+        config.log_json, config.log_level)
+    # Spreadsheet reader chosen for each role
+    logger.info("Reader engines: %s", ", ".join(f"{role}={engine}" for role, engine in READER_ENGINES.items()))
     return start_ts, run_id
 
 def log_shutdown(start_ts, run_id, path, messages, exit_code=0):
     end_ts = time.time()
     duration = end_ts - start_ts
     # File info and type detected
-    logger.info(f"Run ID: {run_id} - analysed file: {path}")
+    logger.info("Run ID: %s - analysed file: %s", run_id, path)
     # Count message levels
-    counts = {'info': sum(1 for _,lvl in messages if lvl=='info'),
-              'ok': sum(1 for _,lvl in messages if lvl=='ok'),
-              'error': sum(1 for _,lvl in messages if lvl=='error') }
-    logger.info(f"Message counts: {counts}")
-    # Detailed failed checks
-    failed = [text for text, lvl in messages if lvl=='error']
-    logger.info(f"Failed checks ({len(failed)}): {failed}")
+    counts = {'info': 0, 'ok': 0, 'error': 0}
+    for _, lvl in messages:
+        counts[lvl] = counts.get(lvl, 0) + 1
+    logger.info("Message counts: %s", counts)
+    # Detailed failed checks - only built when DEBUG records will actually be written
+    logger.info("Failed checks: %d", counts['error'])
+    if logger.isEnabledFor(logging.DEBUG):
+        failed = [text for text, lvl in messages if lvl=='error']
+        logger.debug("Failed check details: %s", failed)
     # Check invocation counts
-    logger.info(f"Check function invocation counts: {check_counts}")
+    logger.info("Check function invocation counts: %s", check_counts)
     # Execution duration and exit status
-    logger.info(f"Execution duration: {duration} seconds")
-    logger.info(f"Exit status code: {exit_code}")
+    logger.info("Execution duration: %s seconds", duration)
+    logger.info("Exit status code: %s", exit_code)
     return exit_code
 
+def select_reader_engines() -> Dict[str, str]:
+    # values: DataFrames for the pandas checks; formats: cell number formats; formulas, tables and
+    # validations: read straight from the sheet XML / table parts.
+    pandas_version = tuple(int(part) for part in re.findall(r"\d+", pd.__version__)[:2])
+    calamine = importlib.util.find_spec("python_calamine") is not None and pandas_version >= (2, 2)
+    # Without calamine pandas picks the engine per file, as the original read_excel did (xlrd for .xls).
+    return {"values": "calamine" if calamine else "default",
+            "formats": "openpyxl-readonly",
+            "formulas": "xml",
+            "tables": "xml",
+            "validations": "xml"}
+
+READER_ENGINES = select_reader_engines()
+
+def is_ooxml(path: Path) -> bool:
+    # .xlsx/.xlsm are zip packages. Legacy .xls can only be read by the values engine (calamine); the
+    # formats, structure, formulas and tables roles need OOXML, so those checks are skipped for it.
+    return zipfile.is_zipfile(path)
+
+def legacy_format_skip(path: Path, what: str) -> List[Tuple[str, str]]:
+    if is_ooxml(path):
+        return []
+    return [(f"{what} can't be checked in a legacy .xls workbook - save it as .xlsx to include it.", "info")]
+
+def values_engine() -> Optional[str]:
+    return None if READER_ENGINES["values"] == "default" else READER_ENGINES["values"]
+
+def open_excel(path: Path) -> pd.ExcelFile:
+    return pd.ExcelFile(str(path), engine=values_engine())
+
+def open_workbook(path: Path, role: str):
+    return load_workbook(str(path), read_only=READER_ENGINES[role] == "openpyxl-readonly", data_only=False)
+
+_NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_DOC_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_NS_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+def _sheet_xml_path(zf: zipfile.ZipFile, sheet: str) -> str:
+    workbook = ET.fromstring(zf.read("xl/workbook.xml"))
+    rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    targets = {rel.get("Id"): rel.get("Target") for rel in rels.iter(f"{_NS_PKG_REL}Relationship")}
+    for node in workbook.iter(f"{_NS_MAIN}sheet"):
+        if node.get("name") == sheet:
+            target = targets[node.get(f"{_NS_DOC_REL}id")]
+            return target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+    raise KeyError(f"sheet '{sheet}' not in workbook.xml")
+
+def _scan_formulas_xml(path: Path, sheet: str, max_row: Optional[int] = None) -> List[Tuple[str, str]]:
+    # Shared-formula children carry no text in the XML, only the anchor cell does.
+    formulas: List[Tuple[str, str]] = []
+    with zipfile.ZipFile(path) as zf, zf.open(_sheet_xml_path(zf, sheet)) as xml:
+        for _, elem in ET.iterparse(xml):
+            if elem.tag == f"{_NS_MAIN}c":
+                f = elem.find(f"{_NS_MAIN}f")
+                if f is not None and f.text:
+                    formulas.append((elem.get("r"), "=" + f.text.upper()))
+            elif elem.tag == f"{_NS_MAIN}row":
+                if max_row is not None and int(elem.get("r", 0)) >= max_row:
+                    break
+                elem.clear()
+    return formulas
+
+def _sheet_tables_xml(path: Path, sheet: str) -> List[str]:
+    # Tables live in their own parts (xl/tables/tableN.xml), so no cell of the sheet has to be read.
+    refs: List[str] = []
+    with zipfile.ZipFile(path) as zf:
+        folder, name = _sheet_xml_path(zf, sheet).rsplit("/", 1)
+        rels_path = f"{folder}/_rels/{name}.rels"
+        if rels_path not in zf.namelist():
+            return refs
+        for rel in ET.fromstring(zf.read(rels_path)).iter(f"{_NS_PKG_REL}Relationship"):
+            if rel.get("Type", "").endswith("/table"):
+                target = rel.get("Target")
+                part = target.lstrip("/") if target.startswith("/") else posixpath.normpath(f"{folder}/{target}")
+                refs.append(ET.fromstring(zf.read(part)).get("ref"))
+    return refs
+
+_DV_START = re.compile(rb"<(?!x14:)(?:\w+:)?dataValidations[\s>/]") # x14 extension rules are ignored, as openpyxl does
+_DV_END = re.compile(rb"</(?:\w+:)?dataValidations>|^<[^>]*/>")
+_DV_RULE = re.compile(rb"<(?:\w+:)?dataValidation\b([^>]*)>")
+_XML_ATTR = re.compile(rb'([\w:]+)="([^"]*)"')
+
+def _sheet_validations_xml(path: Path, sheet: str) -> List[Tuple[Optional[str], str]]:
+    # <dataValidations> sits after <sheetData>: the bytes are searched for it, so no cell is ever parsed.
+    fragment: Optional[bytes] = None
+    tail = b""
+    with zipfile.ZipFile(path) as zf, zf.open(_sheet_xml_path(zf, sheet)) as xml:
+        for chunk in iter(lambda: xml.read(1 << 20), b""):
+            if fragment is None:
+                data = tail + chunk
+                start = _DV_START.search(data)
+                if start is None:
+                    tail = data[-64:]
+                    continue
+                fragment = data[start.start():]
+            else:
+                fragment += chunk
+            end = _DV_END.search(fragment)
+            if end is not None:
+                fragment = fragment[:end.end()]
+                break
+    if fragment is None:
+        return []
+    rules: List[Tuple[Optional[str], str]] = []
+    for rule in _DV_RULE.finditer(fragment):
+        attrs = {key.decode(): value.decode("utf-8") for key, value in _XML_ATTR.findall(rule.group(1))}
+        rules.append((attrs.get("type"), attrs.get("sqref", "")))
+    return rules
+
+def sheet_validations(path: Path, sheet: str) -> List[Tuple[Optional[str], str]]:
+    # (type, space-separated sqref) of each data validation rule on the sheet.
+    if READER_ENGINES["validations"] == "xml":
+        try:
+            return _sheet_validations_xml(path, sheet)
+        except (KeyError, zipfile.BadZipFile, ET.ParseError) as e:
+            logger.debug("Raw XML validation read failed for %s (%s) - using openpyxl", path, e)
+    wb = load_workbook(str(path), data_only=False)
+    return [(dv.type, str(dv.sqref)) for dv in wb[sheet].data_validations.dataValidation]
+
+def sheet_table_refs(path: Path, sheet: str) -> List[str]:
+    if READER_ENGINES["tables"] == "xml":
+        try:
+            return _sheet_tables_xml(path, sheet)
+        except (KeyError, zipfile.BadZipFile, ET.ParseError) as e:
+            logger.debug("Raw XML table read failed for %s (%s) - using openpyxl", path, e)
+    wb = load_workbook(str(path), data_only=False)
+    return [tbl.ref for tbl in wb[sheet].tables.values()]
+
+def scan_formulas(path: Path, sheet: str, max_row: Optional[int] = None) -> List[Tuple[str, str]]:
+    # (coordinate, upper-cased formula) for every formula cell on the sheet, up to max_row.
+    if READER_ENGINES["formulas"] == "xml":
+        try:
+            return _scan_formulas_xml(path, sheet, max_row)
+        except (KeyError, zipfile.BadZipFile, ET.ParseError) as e:
+            logger.debug("Raw XML formula scan failed for %s (%s) - using openpyxl", path, e)
+    wb = load_workbook(str(path), read_only=True, data_only=False)
+    try:
+        formulas: List[Tuple[str, str]] = []
+        for row in wb[sheet].iter_rows(max_row=max_row):
+            for cell in row:
+                if cell.data_type == 'f' and cell.value:
+                    formulas.append((cell.coordinate, str(cell.value).upper()))
+        return formulas
+    finally:
+        wb.close()
+
+PHANTOM_RANGE_FACTOR = 10 # declared range this many times bigger than the data is reported
+PHANTOM_MIN_EXTRA_CELLS = 10_000 # ...but only if that is a meaningful number of empty cells
+_CELL_REF = re.compile(r"([A-Z]+)(\d+)")
+
+@dataclass
+class SheetExtent:
+    declared: str # <dimension ref="..."> as saved, e.g. "A1:XFD1048576"
+    declared_rows: int
+    declared_cols: int
+    last_row: int # last row/column holding a value or formula, 0 for an empty sheet
+    last_col: int
+
+    @property
+    def used_ref(self) -> str:
+        return f"A1:{get_column_letter(max(self.last_col, 1))}{max(self.last_row, 1)}"
+
+    @property
+    def inflated(self) -> bool:
+        declared_cells = self.declared_rows * self.declared_cols
+        used_cells = self.last_row * self.last_col
+        return (declared_cells > PHANTOM_RANGE_FACTOR * max(used_cells, 1)
+                and declared_cells - used_cells > PHANTOM_MIN_EXTRA_CELLS)
+
+@lru_cache(maxsize=32)
+def _sheet_extent(path: str, mtime: float, sheet: str) -> SheetExtent:
+    # One streaming pass over the sheet XML; styled-but-empty cells don't count as data.
+    declared = ""
+    last_row = last_col = 0
+    with zipfile.ZipFile(path) as zf, zf.open(_sheet_xml_path(zf, sheet)) as xml:
+        for _, elem in ET.iterparse(xml):
+            if elem.tag == f"{_NS_MAIN}c":
+                match = _CELL_REF.match(elem.get("r", ""))
+                if match and (elem.find(f"{_NS_MAIN}f") is not None or any(elem.itertext())):
+                    last_row = max(last_row, int(match.group(2)))
+                    last_col = max(last_col, column_index_from_string(match.group(1)))
+            elif elem.tag == f"{_NS_MAIN}row":
+                elem.clear()
+            elif elem.tag == f"{_NS_MAIN}dimension":
+                declared = elem.get("ref", "")
+    try:
+        _, _, declared_cols, declared_rows = range_boundaries(declared)
+    except (ValueError, TypeError):
+        declared_cols, declared_rows = last_col, last_row
+    return SheetExtent(declared, declared_rows or 0, declared_cols or 0, last_row, last_col)
+
+def sheet_extent(path: Optional[Path], sheet: str) -> Optional[SheetExtent]:
+    # None when the extent can't be read cheaply (no path, .xls, damaged zip) - callers then read unbounded.
+    if path is None:
+        return None
+    try:
+        return _sheet_extent(str(path), Path(path).stat().st_mtime, sheet)
+    except (OSError, KeyError, zipfile.BadZipFile, ET.ParseError) as e:
+        logger.debug("Cannot read the data extent of %s!%s (%s)", path, sheet, e)
+        return None
+
+def parse_sheet(excel: pd.ExcelFile, sheet, path: Optional[Path] = None) -> pd.DataFrame:
+    # nrows stops the reader at the last real row instead of walking phantom rows to the sheet's end.
+    extent = sheet_extent(path, sheet) if isinstance(sheet, str) else None
+    if extent is None:
+        return excel.parse(sheet)
+    return excel.parse(sheet, nrows=extent.last_row)
+
+def check_used_range(path: Path, sheet: str) -> List[Tuple[str, str]]:
+    check_counts['check_used_range'] = check_counts.get('check_used_range', 0) + 1
+    results: List[Tuple[str, str]] = []
+    extent = sheet_extent(path, sheet)
+    if extent is not None and extent.inflated:
+        results.append((f"Sheet '{sheet}' declares the range {extent.declared} but data only fills {extent.used_ref} "
+                        f"- stray formatting below/right of the data; checks were limited to {extent.used_ref}.", "info"))
+    return results
+
 def identify_wp3_file(path: Path) -> str:
     check_counts['identify_wp3_file'] = check_counts.get('identify_wp3_file', 0) + 1
     try:
-        df = pd.read_excel(path)
+        with open_excel(path) as excel:
+            df = parse_sheet(excel, excel.sheet_names[0], path)
         rows, _ = df.shape
         columns = set(df.columns)
         if rows > 400 and columns == {"Year", "Album", "Artist", "Total Sales"}: # 400+ lines and exact order of columns
@@ -93,6 +396,10 @@ class Config:
     show_info: bool = True
     show_ok: bool = True
     show_errors: bool = True
+    log_json: bool = False
+    log_level: str = "DEBUG"
+    reference_music: Optional[str] = None
+    reference_dashboard: Optional[str] = None
 
     @classmethod
     def load(cls, path: Path) -> "Config":
@@ -112,9 +419,13 @@ class Config:
                 geometry=data.get("geometry"),
                 show_info=data.get("show_info", "true").lower() == "true",
                 show_ok=data.get("show_ok", "true").lower() == "true",
-                show_errors=data.get("show_errors", "true").lower() == "true")
+                show_errors=data.get("show_errors", "true").lower() == "true",
+                log_json=data.get("log_json", "false").lower() == "true",
+                log_level=data.get("log_level", "DEBUG").upper(),
+                reference_music=data.get("reference_music"),
+                reference_dashboard=data.get("reference_dashboard"))
         except Exception as e:
-            logging.error(f"Error loading config: {e}")
+            logger.error("Error loading config: %s", e)
             return cls(dark_mode=True)
 
     def save(self, path: Path) -> None:
@@ -130,6 +441,12 @@ class Config:
         entries.append(f"show_info={'true' if self.show_info else 'false'}")
         entries.append(f"show_ok={'true' if self.show_ok else 'false'}")
         entries.append(f"show_errors={'true' if self.show_errors else 'false'}")
+        entries.append(f"log_json={'true' if self.log_json else 'false'}")
+        entries.append(f"log_level={self.log_level}")
+        if self.reference_music:
+            entries.append(f"reference_music={self.reference_music}")
+        if self.reference_dashboard:
+            entries.append(f"reference_dashboard={self.reference_dashboard}")
         path.write_text("\n".join(entries))
 
 config = Config.load(Path("config_ECA.txt"))
@@ -137,21 +454,21 @@ current_config = config
 
 def find_latest_excel(download_folder: Path) -> Optional[Path]:
     if not download_folder.is_dir():
-        logging.warning("Downloads folder not found")
+        logger.warning("Downloads folder not found")
         return None
     files = [f for f in download_folder.iterdir() if f.suffix.lower() in (".xls", ".xlsx") and f.is_file()] # finds all excel files
     if not files:
-        logging.info("No Excel files in Downloads")
+        logger.info("No Excel files in Downloads")
         return None
     return max(files, key=lambda f: f.stat().st_mtime) # highest time of last modification [which is the latest modified file]
 
-def select_appropriate_sheet(excel: pd.ExcelFile) -> Tuple[Optional[pd.DataFrame], Optional[str], List[Tuple[str, str]]]:
+def select_appropriate_sheet(excel: pd.ExcelFile, path: Optional[Path] = None) -> Tuple[Optional[pd.DataFrame], Optional[str], List[Tuple[str, str]]]:
     messages: List[Tuple[str, str]] = []
     sheets = excel.sheet_names
     if len(sheets) == 1 and sheets[0].strip().upper() == "RAW DATA":
         messages.append(("[Warning] Only 'RAW DATA' found.", "info"))
         try:
-            df = excel.parse(sheets[0])
+            df = parse_sheet(excel, sheets[0], path)
             return df, sheets[0], messages
         except Exception as e:
             messages.append((f"Cannot parse 'RAW DATA': {e}", "error"))
@@ -162,7 +479,7 @@ def select_appropriate_sheet(excel: pd.ExcelFile) -> Tuple[Optional[pd.DataFrame
         if sheet.strip().upper() == "RAW DATA":
             continue
         try:
-            df_candidate = excel.parse(sheet)
+            df_candidate = parse_sheet(excel, sheet, path)
         except Exception:
             continue
         if df_candidate.shape[1] < 1:
@@ -175,7 +492,7 @@ def select_appropriate_sheet(excel: pd.ExcelFile) -> Tuple[Optional[pd.DataFrame
     if "RAW DATA" in (s.upper() for s in sheets):
         messages.append(("No suitable sheet found - falling back to 'RAW DATA'.", "info"))
         try:
-            df = excel.parse("RAW DATA")
+            df = parse_sheet(excel, "RAW DATA", path)
             return df, "RAW DATA", messages
         except Exception as e:
             messages.append((f"I couldn't open the 'RAW DATA' sheet ({e}).", "error"))
@@ -183,13 +500,13 @@ def select_appropriate_sheet(excel: pd.ExcelFile) -> Tuple[Optional[pd.DataFrame
     messages.append(("The workbook has no 'RAW DATA' sheet.", "error"))
     return None, None, messages
 
-def auto_select_sheet(excel: pd.ExcelFile) -> Tuple[Optional[pd.DataFrame], Optional[str], List[Tuple[str, str]]]:
+def auto_select_sheet(excel: pd.ExcelFile, path: Optional[Path] = None) -> Tuple[Optional[pd.DataFrame], Optional[str], List[Tuple[str, str]]]:
     messages: List[Tuple[str, str]] = []
     sheets = excel.sheet_names
     if len(sheets) == 1 and sheets[0].strip().upper() == "TASK ONE":
         messages.append(("'TASK ONE' found.", "info"))
         try:
-            df = excel.parse(sheets[0])
+            df = parse_sheet(excel, sheets[0], path)
             return df, sheets[0], messages
         except Exception as e:
             messages.append((f"Cannot parse 'Task One': {e}", "error"))
@@ -198,7 +515,7 @@ def auto_select_sheet(excel: pd.ExcelFile) -> Tuple[Optional[pd.DataFrame], Opti
     elif len(sheets) == 1:
         messages.append((f"{sheets} sheet found, and it is the only one in this file, proceeding.", "info"))
         try:
-            df = excel.parse(sheets[0])
+            df = parse_sheet(excel, sheets[0], path)
             return df, sheets[0], messages
         except Exception as e:
             messages.append((f"Cannot parse '{sheets}': {e}", "error"))
@@ -208,7 +525,7 @@ def auto_select_sheet(excel: pd.ExcelFile) -> Tuple[Optional[pd.DataFrame], Opti
         if sheet.strip().upper() == "TASK ONE":
             continue
         try:
-            df_candidate = excel.parse(sheet)
+            df_candidate = parse_sheet(excel, sheet, path)
         except Exception:
             continue
         if df_candidate.shape[1] < 1:
@@ -292,15 +609,18 @@ def check_total_sales(df: pd.DataFrame, path: Path, sheet: str) -> List[Tuple[st
     else:
         col_name = cols[-1]
         results.append((f"'Total Sales' column missing - using '{col_name}' instead.", "info"))
+    skipped = legacy_format_skip(path, f"The format of '{col_name}'")
+    if skipped:
+        return results + skipped
+    wb = None
     try:
-        wb = openpyxl.load_workbook(str(path), data_only=False)
+        wb = open_workbook(path, "formats")
         ws = wb[sheet]
         idx = cols.index(col_name) + 1
-        letter = get_column_letter(idx)
         fmt_ok = True
         prec_ok = True
-        for r in range(2, df.shape[0] + 2):
-            nf = str(ws[f"{letter}{r}"].number_format)
+        for (cell,) in ws.iter_rows(min_row=2, max_row=df.shape[0] + 1, min_col=idx, max_col=idx):
+            nf = str(cell.number_format)
             if "£" not in nf: fmt_ok = False
             if not re.search(r"0\.00", nf): prec_ok = False
             if not fmt_ok or not prec_ok: break
@@ -314,6 +634,9 @@ def check_total_sales(df: pd.DataFrame, path: Path, sheet: str) -> List[Tuple[st
             results.append((f"'{col_name}' does not show two decimal places.", "error"))
     except Exception as e:
         results.append((f"Couldn't verify the format or precision of '{col_name}' ({e}).", "error"))
+    finally:
+        if wb is not None:
+            wb.close() # read-only workbooks keep the file open (and locked on Windows) until closed
     return results
 
 def check_qs(df: pd.DataFrame, path: Path, sheet: str) -> List[Tuple[str, str]]:
@@ -335,31 +658,26 @@ def check_qs(df: pd.DataFrame, path: Path, sheet: str) -> List[Tuple[str, str]]:
 
 def check_validation(df: pd.DataFrame, path: Path, sheet: str) -> List[Tuple[str, str]]:
     check_counts['check_validation'] = check_counts.get('check_validation', 0) + 1
-    results: List[Tuple[str, str]] = []
-    cols = list(df.columns)
-    wb = load_workbook(path)
-    ws = wb[sheet]
-    # Identify the target column by header name
-    header_row = 1
-    # Map headers to column indices
-    header_to_col = {cell.value: cell.column for cell in ws[header_row]}
+    results: List[Tuple[str, str]] = legacy_format_skip(path, "Data validation")
+    if results:
+        return results
+    # Identify the target column by header name: the DataFrame's columns are header row 1 in sheet order
+    header_to_col = {column: index for index, column in enumerate(df.columns, start=1)}
+    validations = sheet_validations(path, sheet)
     # Check each validation rule
     def validate(type_of_validation, column_name):
         target_header = column_name
         target_col_index = header_to_col[column_name]
-        target_col_letter = get_column_letter(target_col_index)
-        # Get all data validations
-        validations = list(ws.data_validations.dataValidation)
         applied = False
-        for dv in validations:
-            if dv.type != type_of_validation:
+        for dv_type, sqref in validations:
+            if dv_type != type_of_validation:
                 continue
-            for cell_range in dv.sqref:  # each item is already a CellRange
-                min_col, min_row, max_col, max_row = cell_range.bounds
-            if min_col <= target_col_index <= max_col:
-                applied = True
-                results.append((f"'{type_of_validation}' validation applied to '{target_header}' in range {cell_range} [OK]", "ok"))
-                break
+            for cell_range in sqref.split():
+                min_col, min_row, max_col, max_row = range_boundaries(cell_range)
+                if min_col <= target_col_index <= max_col:
+                    applied = True
+                    results.append((f"'{type_of_validation}' validation applied to '{target_header}' in range {cell_range} [OK]", "ok"))
+                    break
             if applied:
                 break
         if not applied:
@@ -370,7 +688,9 @@ def check_validation(df: pd.DataFrame, path: Path, sheet: str) -> List[Tuple[str
 
 def check_functions(df: pd.DataFrame, path: Path, sheet: str) -> List[Tuple[str, str]]:
     check_counts['check_functions'] = check_counts.get('check_functions', 0) + 1
-    results: List[Tuple[str, str]] = []
+    results: List[Tuple[str, str]] = legacy_format_skip(path, "Use of functions")
+    if results:
+        return results
 
     primary_functions = {'SUM', 'MAX', 'MIN', 'AVERAGE', 'MEDIAN', 'MODE', 'STDEV.S'}
     alternative_forms = {'STDEV.S': 'STDEV'}
@@ -378,19 +698,14 @@ def check_functions(df: pd.DataFrame, path: Path, sheet: str) -> List[Tuple[str,
     found_functions = set()
     found_alternatives = set()
 
-    wb = load_workbook(path, data_only=False)
-    ws = wb[sheet]
-
-    for row in ws.iter_rows():
-        for cell in row:
-            if cell.data_type == 'f' and cell.value:
-                formula = str(cell.value).upper()
-                for func in primary_functions:
-                    if func in formula:
-                        found_functions.add(func)
-                for alt_func in alternative_forms.values():
-                    if alt_func in formula:
-                        found_alternatives.add(alt_func)
+    extent = sheet_extent(path, sheet)
+    for _, formula in scan_formulas(path, sheet, extent.last_row if extent else None):
+        for func in primary_functions:
+            if func in formula:
+                found_functions.add(func)
+        for alt_func in alternative_forms.values():
+            if alt_func in formula:
+                found_alternatives.add(alt_func)
     missing_functions = primary_functions - found_functions
 
     # Check for acceptable alternatives
@@ -412,19 +727,18 @@ def check_functions(df: pd.DataFrame, path: Path, sheet: str) -> List[Tuple[str,
 
 def check_table_format(df: pd.DataFrame, path: Path, sheet: str) -> List[Tuple[str, str]]:
     check_counts['check_table_format'] = check_counts.get('check_table_format', 0) + 1
-    results: List[Tuple[str, str]] = []
+    results: List[Tuple[str, str]] = legacy_format_skip(path, "The Excel table format")
+    if results:
+        return results
     try:
-        wb = openpyxl.load_workbook(str(path), data_only=False)
-        ws = wb[sheet]
-        tables = ws.tables
+        tables = sheet_table_refs(path, sheet)
         if not tables:
             results.append(("The data isn't in an Excel table format.", "error"))
             return results
         if len(tables) > 1:
             results.append(("More than one Excel table found on the sheet.", "error"))
             return results
-        tbl = next(iter(tables.values()))
-        min_col, min_row, max_col, max_row = range_boundaries(tbl.ref)
+        min_col, min_row, max_col, max_row = range_boundaries(tables[0])
         expected_max_col = df.shape[1]
         expected_max_row = df.shape[0] + 1
         if (min_row, min_col) == (1, 1) and max_col == expected_max_col:
@@ -438,33 +752,139 @@ def check_table_format(df: pd.DataFrame, path: Path, sheet: str) -> List[Tuple[s
         results.append((f"Cannot verify table format: {e}", "error"))
     return results
 
-def analyse_excel(path: Path) -> List[Tuple[str, str]]:
+REFERENCE_KEYS = {"music": ("Year", "Album", "Artist"), "dashboard": ("Name", "Date")}
+
+@dataclass
+class ReferenceIndex:
+    file_type: str
+    columns: List[str]
+    rows: pd.DataFrame # index: row-key hash; columns 'value' (hash of the whole row) and 'row' (Excel row)
+
+def _canonical_cell(value, as_key: bool) -> str:
+    # Each cell is encoded on its own, so one stray entry never changes how the rest of its column hashes.
+    # Blanks -> "", dates -> ISO text, anything numeric (typed or as text) -> float repr, else stripped text.
+    if isinstance(value, str):
+        text = value.strip()
+    elif value is None or pd.isna(value):
+        return ""
+    elif isinstance(value, date):
+        return pd.Timestamp(value).isoformat()
+    else:
+        text = str(value).strip()
+    try:
+        return repr(float(text))
+    except ValueError:
+        return text.lower() if as_key else text
+
+def _canonical_column(col: pd.Series, as_key: bool) -> pd.Series:
+    return col.astype(object).map(lambda value: _canonical_cell(value, as_key))
+
+def _value_hashes(df: pd.DataFrame, columns: List[str]) -> np.ndarray:
+    values = df.reindex(columns=columns)
+    values = pd.DataFrame({col: _canonical_column(values[col], as_key=False) for col in columns})
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+def _hash_rows(df: pd.DataFrame, key_columns: Tuple[str, ...], columns: List[str]) -> pd.DataFrame:
+    keys = pd.DataFrame({col: _canonical_column(df[col], as_key=True) for col in key_columns})
+    keys["occurrence"] = keys.groupby(list(key_columns)).cumcount() # repeated keys stay distinct
+    return pd.DataFrame({"value": _value_hashes(df, columns),
+                         "row": df.index.to_numpy() + 2},
+                        index=pd.util.hash_pandas_object(keys, index=False).to_numpy())
+
+def build_reference_index(df: pd.DataFrame, file_type: str) -> ReferenceIndex:
+    return ReferenceIndex(file_type, list(df.columns), _hash_rows(df, REFERENCE_KEYS[file_type], list(df.columns)))
+
+@lru_cache(maxsize=4)
+def _load_reference(path: str, mtime: float, file_type: str) -> ReferenceIndex:
+    # mtime is part of the cache key so an edited reference workbook is re-indexed.
+    selector = select_appropriate_sheet if file_type == "music" else auto_select_sheet
+    with open_excel(Path(path)) as excel:
+        df, sheet, _ = selector(excel, Path(path)) or (None, None, [])
+    if df is None:
+        raise ValueError(f"no {file_type} sheet found in {path}")
+    logger.info("Indexed %s reference %s!%s (%d rows)", file_type, path, sheet, len(df))
+    return build_reference_index(df, file_type)
+
+def reference_index(file_type: str) -> Optional[ReferenceIndex]:
+    ref = current_config.reference_music if file_type == "music" else current_config.reference_dashboard
+    if not ref:
+        return None
+    return _load_reference(str(Path(ref)), Path(ref).stat().st_mtime, file_type)
+
+def diff_against_reference(df: pd.DataFrame, reference: ReferenceIndex) -> Tuple[List[int], List[int], List[int]]:
+    # (added, removed, altered): submission rows absent from the reference, reference rows absent
+    # from the submission (reference row numbers), and rows whose key matches but whose values differ.
+    submitted = _hash_rows(df, REFERENCE_KEYS[reference.file_type], reference.columns)
+    ref_rows = reference.rows
+    matched = submitted.index.isin(ref_rows.index)
+    added = submitted.loc[~matched, "row"].tolist()
+    removed = ref_rows.loc[~ref_rows.index.isin(submitted.index), "row"].tolist()
+    common = submitted[matched]
+    changed = common["value"].to_numpy() != ref_rows["value"].reindex(common.index).to_numpy()
+    altered = common.loc[changed, "row"].tolist()
+    return sorted(added), sorted(removed), sorted(altered)
+
+def check_reference_diff(df: pd.DataFrame, file_type: str) -> List[Tuple[str, str]]:
+    check_counts['check_reference_diff'] = check_counts.get('check_reference_diff', 0) + 1
+    results: List[Tuple[str, str]] = []
+    try:
+        reference = reference_index(file_type)
+    except Exception as e:
+        results.append((f"Couldn't load the reference dataset ({e}).", "error"))
+        return results
+    if reference is None:
+        return results
+    missing = [col for col in REFERENCE_KEYS[file_type] if col not in df.columns]
+    if missing:
+        results.append((f"Can't compare with the reference dataset - missing column(s) {missing}.", "info"))
+        return results
+    try:
+        added, removed, altered = diff_against_reference(df, reference)
+    except Exception as e:
+        results.append((f"Couldn't compare the data with the reference dataset ({e}).", "error"))
+        return results
+    if not (added or removed or altered):
+        results.append(("Data matches the reference dataset row for row. [OK]", "ok"))
+        return results
+    results.append((f"Data differs from the reference dataset: {len(altered)} altered, "
+                    f"{len(added)} added, {len(removed)} missing rows.", "error"))
+    if altered:
+        results.append((f"Rows with values different from the reference: {altered}.", "error"))
+    if added:
+        results.append((f"Rows not found in the reference: {added}.", "error"))
+    if removed:
+        results.append((f"Reference rows missing from the submission: {removed}.", "error"))
+    return results
+
+def analyse_excel(path: Path, file_type: Optional[str] = None) -> List[Tuple[str, str]]:
     messages: List[Tuple[str, str]] = []
-    file_type = identify_wp3_file(path)
+    file_type = file_type or identify_wp3_file(path)
 
     if file_type == "music":
         messages.append(("Detected WP3 - Music Data", "info"))
-        excel_file = pd.ExcelFile(str(path))
-
-        df, sheet, sel_msgs = select_appropriate_sheet(excel_file)
+        with open_excel(path) as excel_file:
+            df, sheet, sel_msgs = select_appropriate_sheet(excel_file, path)
         messages.extend(sel_msgs)
         if df is None or sheet is None:
             return messages
+        messages.extend(check_used_range(path, sheet))
         messages.extend(check_nulls(df))
         messages.extend(check_artist_column(df))
         messages.extend(check_duplicates(df))
         messages.extend(check_album_duplicates(df))
         messages.extend(check_total_sales(df, path, sheet))
+        messages.extend(check_reference_diff(df, file_type))
         messages.extend(check_table_format(df, path, sheet))
         return messages
         
     elif file_type == "dashboard":
         messages.append(("Detected WP3 - Excel Stats Dashboard", "info"))
-        excel_file = pd.ExcelFile(str(path))
-        df, sheet, sel_msgs = auto_select_sheet(excel_file)
+        with open_excel(path) as excel_file:
+            df, sheet, sel_msgs = auto_select_sheet(excel_file, path)
         messages.extend(sel_msgs)
         if df is None or sheet is None:
             return messages
+        messages.extend(check_used_range(path, sheet))
         # to finalise:
         # check if QS is Quality Surveyor [outcomes[+/-]]
         messages.extend(check_qs(df, path, sheet))
@@ -474,6 +894,7 @@ def analyse_excel(path: Path) -> List[Tuple[str, str]]:
         
         # check if functions like =SUM(), =MAX(), =MIN(), =AVERAGE(), =MEDIAN(), =MODE(), =STDEV.S() are used in the spreadsheet [outcomes[+/-/partial]].
         messages.extend(check_functions(df, path, sheet))
+        messages.extend(check_reference_diff(df, file_type))
         return messages
     elif file_type == "error":
         messages.append(("Close Excel with the workbook and run the check again.", "error"))
@@ -482,6 +903,324 @@ def analyse_excel(path: Path) -> List[Tuple[str, str]]:
         messages.append(("File did not match any known WP3 format", "error"))
         return messages
 
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 32 # 32 bands x 4 rows: a pair shares a bucket with probability 1-(1-s**4)**32, >99.9% from s=0.7
+SIMILARITY_THRESHOLD = 0.8
+_MINHASH_PRIME = 4_294_967_311 # smallest prime above 2**32
+_minhash_rng = np.random.default_rng(20250707) # fixed seed so signatures are comparable between runs
+_MINHASH_A = _minhash_rng.integers(1, 2**31, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_MINHASH_B = _minhash_rng.integers(0, 2**31, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+FINGERPRINT_COMPONENTS = ("data", "formulas", "structure")
+COMMON_SHINGLE_SHARE = 0.5 # shingles in more than half the cohort are what everyone was given...
+COMMON_SHINGLE_MIN_COUNT = 3 # ...and never dropped when only a pair shares them
+MIN_COMPONENT_SHINGLES = 3 # components left with fewer rare shingles are not signed
+LSH_BUCKET_CAP = 50 # buckets up to this size are compared pairwise; larger ones only against their first member
+
+def _hash_tokens(tokens: List[str]) -> np.ndarray:
+    return pd.util.hash_pandas_object(pd.Series(tokens, dtype=object), index=False).to_numpy(dtype=np.uint64)
+
+def workbook_fingerprint(path: Path) -> Optional[Dict[str, np.ndarray]]:
+    # Shingle hashes of the reviewed sheet, kept per component so shared raw data can't outweigh layout:
+    # data - one per row not already in the reference dataset; formulas - each formula with its cell;
+    # structure - sheets, headers, tables, validations, dimension and the number format of each column.
+    file_type = identify_wp3_file(path)
+    if file_type not in ("music", "dashboard"):
+        return None
+    try:
+        selector = select_appropriate_sheet if file_type == "music" else auto_select_sheet
+        with open_excel(path) as excel_file:
+            df, sheet, _ = selector(excel_file, path) or (None, None, [])
+            sheet_names = list(excel_file.sheet_names)
+        if df is None or sheet is None:
+            return None
+        extent = sheet_extent(path, sheet)
+        formulas = [f"f:{coord}:{formula}" for coord, formula in scan_formulas(path, sheet, extent.last_row if extent else None)]
+        structure = [f"sheet:{name}" for name in sheet_names]
+        structure += [f"col:{col}" for col in df.columns]
+        structure += [f"table:{ref}" for ref in sheet_table_refs(path, sheet)]
+        structure += [f"dv:{dv_type}:{sqref}" for dv_type, sqref in sheet_validations(path, sheet)]
+        if extent is not None:
+            structure.append(f"dim:{extent.declared}")
+        wb = open_workbook(path, "formats")
+        try:
+            # Only row 2 is streamed: the number format each column's data starts with.
+            row = next(wb[sheet].iter_rows(min_row=2, max_row=2, max_col=df.shape[1]), ())
+            structure += [f"fmt:{get_column_letter(c)}:{getattr(cell, 'number_format', 'General')}"
+                          for c, cell in enumerate(row, start=1)]
+        finally:
+            wb.close()
+    except Exception as e:
+        logger.warning("Cannot fingerprint %s: %s", path, e)
+        return None
+    try:
+        reference = reference_index(file_type)
+    except Exception:
+        reference = None
+    data = np.unique(_value_hashes(df, reference.columns if reference else list(df.columns)))
+    if reference is not None:
+        data = np.setdiff1d(data, reference.rows["value"].to_numpy())
+    return {"data": data, "formulas": np.unique(_hash_tokens(formulas)), "structure": np.unique(_hash_tokens(structure))}
+
+def drop_common_shingles(fingerprints: Dict[str, Dict[str, np.ndarray]]) -> Dict[str, Dict[str, np.ndarray]]:
+    # Everyone cleans the same raw data and starts from the same template; only what is rarer is evidence.
+    limit = max(COMMON_SHINGLE_SHARE * len(fingerprints), COMMON_SHINGLE_MIN_COUNT - 1)
+    filtered: Dict[str, Dict[str, np.ndarray]] = {name: {} for name in fingerprints}
+    for component in FINGERPRINT_COMPONENTS:
+        parts = [fp.get(component, np.empty(0, dtype=np.uint64)) for fp in fingerprints.values()]
+        shingles, counts = np.unique(np.concatenate(parts) if parts else np.empty(0, dtype=np.uint64), return_counts=True)
+        common = shingles[counts > limit]
+        for name, part in zip(fingerprints, parts):
+            filtered[name][component] = np.setdiff1d(part, common)
+    return filtered
+
+def minhash_signature(shingles: np.ndarray) -> np.ndarray:
+    if shingles.size == 0:
+        return np.full(MINHASH_PERMUTATIONS, _MINHASH_PRIME, dtype=np.uint64)
+    x = shingles % np.uint64(_MINHASH_PRIME)
+    # a < 2**31 and x < 2**33, so a*x + b stays inside uint64
+    return ((_MINHASH_A[:, None] * x[None, :] + _MINHASH_B[:, None]) % np.uint64(_MINHASH_PRIME)).min(axis=1)
+
+def cluster_signatures(signatures: Dict[str, Dict[str, np.ndarray]],
+                       threshold: float = SIMILARITY_THRESHOLD) -> List[Tuple[List[str], float, List[str]]]:
+    # signatures: file -> component -> MinHash signature; empty components are left out.
+    # LSH per component: only files sharing a band bucket are compared. Each component is clustered on its
+    # own, so a formulas match and a structure match never chain into one group; component clusters with
+    # the same members are reported once, with their best similarity and all the components that matched.
+    names = list(signatures)
+    rows = MINHASH_PERMUTATIONS // LSH_BANDS
+    found: Dict[Tuple[str, ...], Tuple[float, Set[str]]] = {}
+    for component in FINGERPRINT_COMPONENTS:
+        parent = list(range(len(names)))
+        best: Dict[int, float] = {}
+        compared: Set[Tuple[int, int]] = set()
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        holders = [i for i, name in enumerate(names) if component in signatures[name]]
+        for band in range(LSH_BANDS):
+            buckets: Dict[bytes, List[int]] = {}
+            for i in holders:
+                key = signatures[names[i]][component][band * rows:(band + 1) * rows].tobytes()
+                buckets.setdefault(key, []).append(i)
+            for members in buckets.values():
+                if len(members) <= LSH_BUCKET_CAP:
+                    pairs = ((a, b) for n, a in enumerate(members) for b in members[n + 1:])
+                else:
+                    pairs = ((members[0], b) for b in members[1:])
+                for a, b in pairs:
+                    if (a, b) in compared:
+                        continue
+                    compared.add((a, b))
+                    similarity = float(np.mean(signatures[names[a]][component] == signatures[names[b]][component]))
+                    if similarity < threshold:
+                        continue
+                    root_a, root_b = find(a), find(b)
+                    if root_a != root_b:
+                        parent[root_b] = root_a
+                    best[root_a] = max(best.get(root_a, 0.0), best.pop(root_b, 0.0), similarity)
+
+        groups: Dict[int, List[str]] = {}
+        for i in holders:
+            groups.setdefault(find(i), []).append(names[i])
+        for root, members in groups.items():
+            if len(members) > 1:
+                similarity, components = found.get(tuple(members), (0.0, set()))
+                found[tuple(members)] = (max(similarity, best[root]), components | {component})
+
+    result = [(list(members), similarity, sorted(components)) for members, (similarity, components) in found.items()]
+    return sorted(result, key=lambda c: (-len(c[0]), -c[1]))
+
+def cluster_fingerprints(fingerprints: Dict[str, Dict[str, np.ndarray]],
+                         threshold: float = SIMILARITY_THRESHOLD) -> List[Tuple[List[str], float, List[str]]]:
+    # A component needs a few rare shingles left before it counts as evidence: files that merely
+    # share one common omission (say, a missing number format) must not match on that alone.
+    signatures = {name: {component: minhash_signature(shingles) for component, shingles in parts.items()
+                         if shingles.size >= MIN_COMPONENT_SHINGLES}
+                  for name, parts in drop_common_shingles(fingerprints).items()}
+    return cluster_signatures(signatures, threshold)
+
+def find_similar_submissions(folder: Path, threshold: float = SIMILARITY_THRESHOLD,
+                             workers: Optional[int] = None) -> Tuple[List[Tuple[List[str], float, List[str]]], List[str]]:
+    paths = sorted(f for f in folder.iterdir() if f.suffix.lower() in (".xls", ".xlsx") and f.is_file())
+    fingerprints: Dict[str, Dict[str, np.ndarray]] = {}
+    skipped: List[str] = []
+    worker_queue, worker_listener = start_worker_logging()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_warm_worker,
+                                 initargs=(worker_queue, logging.getLogger().level)) as pool:
+            for path, fingerprint in zip(paths, pool.map(workbook_fingerprint, paths)):
+                if fingerprint is None:
+                    skipped.append(path.name)
+                else:
+                    fingerprints[path.name] = fingerprint
+    finally:
+        worker_listener.stop()
+    logger.info("Fingerprinted %d workbooks in %s (%d skipped)", len(fingerprints), folder, len(skipped))
+    return cluster_fingerprints(fingerprints, threshold), skipped
+
+SERVICE_HOST = "127.0.0.1" # localhost only - the service reads arbitrary paths it is given
+SERVICE_PORT = 8765
+SERVICE_MAX_UPLOAD = 50 * 1024 * 1024
+SERVICE_TIMEOUT = 120 # seconds a single analysis may take before the request fails
+
+def _warm_worker(log_queue: Optional["multiprocessing.Queue[logging.LogRecord]"] = None,
+                 log_level: int = logging.WARNING) -> None:
+    # Forked workers inherit the parent's QueueHandler but not its listener thread;
+    # route their records through log_queue to the parent's worker listener instead.
+    root_logger = logging.getLogger()
+    root_logger.handlers.clear()
+    if log_queue is not None:
+        root_logger.addHandler(TracebackQueueHandler(log_queue))
+        root_logger.setLevel(log_level)
+    # Ctrl+C reaches the whole process group; the parent shuts the pool down cleanly.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Run the Excel read/write paths once so the first real request doesn't pay for the lazy imports.
+    buffer = io.BytesIO()
+    pd.DataFrame({"A": [1]}).to_excel(buffer, index=False)
+    pd.read_excel(io.BytesIO(buffer.getvalue()), engine=values_engine())
+    load_workbook(io.BytesIO(buffer.getvalue())).close()
+    # Build the reference indexes once per worker so every request reuses them.
+    for file_type in REFERENCE_KEYS:
+        try:
+            reference_index(file_type)
+        except Exception:
+            pass # reported by check_reference_diff on the first request
+
+def _worker_pid(_: int) -> int:
+    return os.getpid()
+
+def _analyse_in_worker(path: str) -> Tuple[str, List[Tuple[str, str]]]:
+    # The file type is returned too, so the service can answer unreadable workbooks with a 4xx itself.
+    file_type = identify_wp3_file(Path(path))
+    if file_type == "error":
+        return file_type, []
+    return file_type, analyse_excel(Path(path), file_type)
+
+SERVICE_UPLOAD_SUFFIXES = (".xlsx", ".xlsm", ".xls")
+
+def upload_suffix(filename: str) -> Optional[str]:
+    # Suffix for the temporary upload file, taken from X-Filename; None for types that can't be read.
+    suffix = Path(filename).suffix.lower() or ".xlsx"
+    return suffix if suffix in SERVICE_UPLOAD_SUFFIXES else None
+
+def analysis_payload(path: str, messages: List[Tuple[str, str]], duration: float) -> Dict[str, object]:
+    counts = {'info': 0, 'ok': 0, 'error': 0}
+    for _, lvl in messages:
+        counts[lvl] = counts.get(lvl, 0) + 1
+    return {"file": path,
+            "passed": counts['error'] == 0,
+            "counts": counts,
+            "messages": [{"text": text, "level": lvl} for text, lvl in messages],
+            "duration_ms": round(duration * 1000, 1)}
+
+class AnalysisRequestHandler(BaseHTTPRequestHandler):
+    # GET /health, POST /analyse with {"path": "..."} as JSON or the raw .xlsx bytes as the body.
+    server_version = "ECA/1.0"
+
+    def _send_json(self, status: int, payload: Dict[str, object]) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.info("HTTP %s " + format, self.address_string(), *args)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok", "workers": self.server.workers, "engines": READER_ENGINES})
+        else:
+            self._send_json(404, {"error": f"Unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/analyse":
+            self._send_json(404, {"error": f"Unknown endpoint {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            self._send_json(400, {"error": "Content-Length must be a whole number of bytes."})
+            return
+        if length <= 0:
+            self._send_json(400, {"error": "Request body is empty."})
+            return
+        if length > SERVICE_MAX_UPLOAD:
+            self._send_json(413, {"error": f"Upload exceeds {SERVICE_MAX_UPLOAD} bytes."})
+            return
+        body = self.rfile.read(length)
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        temp_path: Optional[Path] = None
+        try:
+            if content_type == "application/json":
+                try:
+                    path = Path(json.loads(body)["path"])
+                except (ValueError, KeyError, TypeError) as e:
+                    self._send_json(400, {"error": f"Expected a JSON body with a 'path' key ({e})."})
+                    return
+                if not path.is_file():
+                    self._send_json(404, {"error": f"File not found: {path}"})
+                    return
+                name = str(path)
+            else:
+                name = self.headers.get("X-Filename", "upload.xlsx")
+                suffix = upload_suffix(name)
+                if suffix is None:
+                    self._send_json(415, {"error": f"Unsupported upload '{name}' - send a {'/'.join(SERVICE_UPLOAD_SUFFIXES)} workbook."})
+                    return
+                fd, temp_name = tempfile.mkstemp(prefix="eca_", suffix=suffix)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(body)
+                path = temp_path = Path(temp_name)
+            start = time.perf_counter()
+            try:
+                file_type, messages = self.server.pool.submit(_analyse_in_worker, str(path)).result(timeout=SERVICE_TIMEOUT)
+            except Exception as e:
+                logger.exception("Analysis of %s failed", name)
+                self._send_json(500, {"error": f"Analysis failed: {e}"})
+                return
+            if file_type == "error":
+                if temp_path is not None:
+                    error = f"The upload '{name}' could not be read as an Excel workbook - it may be corrupt or not a {suffix} file."
+                else:
+                    error = f"The workbook at {name} could not be read - it may be open in Excel, corrupt or not an Excel file."
+                self._send_json(422, {"error": error})
+                return
+            self._send_json(200, analysis_payload(name, messages, time.perf_counter() - start))
+        finally:
+            if temp_path is not None:
+                try:
+                    temp_path.unlink()
+                except OSError as e:
+                    logger.warning("Could not remove upload %s: %s", temp_path, e)
+
+def run_service(host: str = SERVICE_HOST, port: int = SERVICE_PORT, workers: Optional[int] = None) -> None:
+    workers = workers or os.cpu_count() or 2
+    worker_queue, worker_listener = start_worker_logging()
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_warm_worker,
+                               initargs=(worker_queue, logging.getLogger().level))
+    # Submitting one task per worker starts them all now, so no request waits for interpreter start-up.
+    pids = set(pool.map(_worker_pid, range(workers)))
+    server = ThreadingHTTPServer((host, port), AnalysisRequestHandler)
+    server.pool = pool
+    server.workers = workers
+    logger.info("Service listening on http://%s:%s with worker pids %s", host, port, sorted(pids))
+    print(f"ECA service listening on http://{host}:{port} ({workers} workers). Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.shutdown()
+        worker_listener.stop()
+
 
 class ToolTip:
     def __init__(self, widget: tk.Widget, text_fn):
@@ -763,10 +1502,202 @@ if __name__=="__main__":
                 msgs = check_nulls(df)
                 self.assertIn(("No blank cells found. [OK]", "ok"), msgs)
 
+            def test_json_log_line_has_run_id(self):
+                record = logging.LogRecord("ECA", logging.INFO, __file__, 0, "Run %s", ("x",), None)
+                record.run_id = "abc"
+                entry = json.loads(JsonLinesFormatter().format(record))
+                self.assertEqual((entry["run_id"], entry["message"]), ("abc", "Run x"))
+
+            def test_queued_exception_keeps_traceback(self):
+                log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue()
+                try:
+                    raise ValueError("boom")
+                except ValueError:
+                    record = logging.LogRecord("ECA", logging.ERROR, __file__, 0, "Failed %s", ("x",), sys.exc_info())
+                TracebackQueueHandler(log_queue).handle(record)
+                entry = json.loads(JsonLinesFormatter().format(log_queue.get_nowait()))
+                self.assertEqual(entry["message"], "Failed x")
+                self.assertIn("ValueError: boom", entry["exc"])
+
+            def test_analysis_payload_counts(self):
+                payload = analysis_payload("f.xlsx", [("a", "info"), ("b", "error")], 0.5)
+                self.assertEqual(payload["counts"], {'info': 1, 'ok': 0, 'error': 1})
+                self.assertFalse(payload["passed"])
+
+            def test_upload_suffix_follows_filename(self):
+                self.assertEqual([upload_suffix(n) for n in ("a.XLS", "b.xlsx", "noext", "c.csv")],
+                                 [".xls", ".xlsx", ".xlsx", None])
+
+            def test_xml_formula_scan_matches_openpyxl(self):
+                wb = openpyxl.Workbook()
+                wb.active.title = "Data"
+                wb.active["A1"], wb.active["B2"] = 1, "=sum(A1:A1)"
+                with tempfile.TemporaryDirectory() as tmp:
+                    path = Path(tmp) / "f.xlsx"
+                    wb.save(path)
+                    self.assertEqual(_scan_formulas_xml(path, "Data"), [("B2", "=SUM(A1:A1)")])
+                    self.assertEqual(_sheet_tables_xml(path, "Data"), [])
+                    READER_ENGINES["formulas"] = "openpyxl-readonly"
+                    try:
+                        self.assertEqual(scan_formulas(path, "Data"), [("B2", "=SUM(A1:A1)")])
+                    finally:
+                        READER_ENGINES["formulas"] = "xml"
+
+            def test_xml_validations_match_openpyxl(self):
+                from openpyxl.worksheet.datavalidation import DataValidation
+                wb = openpyxl.Workbook()
+                ws = wb.active
+                ws.title = "Staff"
+                ws.append(["Name", "Department", "Rating"])
+                ws.append(["A", "Ops", 1])
+                ws.add_data_validation(DataValidation(type="list", formula1='"Ops,HR"', sqref="B2:B10 E1"))
+                ws.add_data_validation(DataValidation(type="whole", sqref="C2:C10"))
+                df = pd.DataFrame({"Name": ["A"], "Department": ["Ops"], "Rating": [1]})
+                with tempfile.TemporaryDirectory() as tmp:
+                    path = Path(tmp) / "v.xlsx"
+                    wb.save(path)
+                    rules = _sheet_validations_xml(path, "Staff")
+                    self.assertEqual(sorted(rules), [("list", "B2:B10 E1"), ("whole", "C2:C10")])
+                    self.assertEqual([lvl for _, lvl in check_validation(df, path, "Staff")], ["ok", "ok"])
+                    READER_ENGINES["validations"] = "openpyxl"
+                    try:
+                        self.assertEqual(sorted(sheet_validations(path, "Staff")), sorted(rules))
+                    finally:
+                        READER_ENGINES["validations"] = "xml"
+
+            def test_sheet_extent_ignores_formatted_empty_cells(self):
+                wb = openpyxl.Workbook()
+                ws = wb.active
+                ws.title = "Data"
+                ws.append(["Year", "Sales"])
+                ws.append([2000, 5])
+                ws["Z6000"].number_format = "0.00" # stray formatting, no value
+                with tempfile.TemporaryDirectory() as tmp:
+                    path = Path(tmp) / "phantom.xlsx"
+                    wb.save(path)
+                    extent = sheet_extent(path, "Data")
+                    self.assertEqual((extent.declared, extent.last_row, extent.last_col), ("A1:Z6000", 2, 2))
+                    self.assertTrue(extent.inflated)
+                    self.assertEqual(len(check_used_range(path, "Data")), 1)
+
+            def test_legacy_xls_skips_openpyxl_checks(self):
+                df = pd.DataFrame({"Name": ["A"], "Department": ["Ops"], "Rating": [1]})
+                with tempfile.TemporaryDirectory() as tmp:
+                    path = Path(tmp) / "old.xls"
+                    path.write_bytes(b"\xd0\xcf\x11\xe0 not a zip package")
+                    for check in (check_validation, check_functions, check_table_format):
+                        self.assertEqual([lvl for _, lvl in check(df, path, "Sheet1")], ["info"])
+
+            def test_reference_diff_reports_excel_rows(self):
+                ref = pd.DataFrame({"Year": [2000, 2001, 2002], "Album": ["A", "B", "C"],
+                                    "Artist": ["X", "Y", "Z"], "Total Sales": [1, 2, 3]})
+                sub = pd.DataFrame({"Year": [2000, 2001, 2003], "Album": ["A", "B", "D"],
+                                    "Artist": [" X", "y", "W"], "Total Sales": [1, 5, 4]})
+                added, removed, altered = diff_against_reference(sub, build_reference_index(ref, "music"))
+                # Outer spaces are left to check_artist_column; 'y' vs 'Y' and the sales change are altered.
+                self.assertEqual((added, removed, altered), ([4], [4], [3]))
+
+            def test_reference_diff_stray_cells_stay_local(self):
+                ref = pd.DataFrame({"Year": [2000, 2001, 2002, 2003, 2004], "Album": list("ABCDE"),
+                                    "Artist": list("VWXYZ"), "Total Sales": [1.0, 2.0, 3.0, 4.0, 5.0]})
+                sub = ref.astype(object)
+                sub.loc[1, "Year"] = "unknown" # stray text in a key column
+                sub.loc[2, "Album"] = None # blank in a key column
+                sub.loc[3, "Total Sales"] = "n/a" # stray text in a value column
+                sub.loc[4, "Total Sales"] = None # blank in a value column
+                sub.loc[0, "Year"] = " 2000 " # number typed as text still matches
+                added, removed, altered = diff_against_reference(sub, build_reference_index(ref, "music"))
+                self.assertEqual((added, removed, altered), ([3, 4], [3, 4], [5, 6]))
+
+            def test_cluster_signatures_groups_identical(self):
+                shared = minhash_signature(np.arange(500, dtype=np.uint64))
+                other = minhash_signature(np.arange(10_000, 10_500, dtype=np.uint64))
+                clusters = cluster_signatures({"a.xlsx": {"formulas": shared}, "b.xlsx": {"formulas": shared.copy()},
+                                               "c.xlsx": {"formulas": other}, "d.xlsx": {}})
+                self.assertEqual(clusters, [(["a.xlsx", "b.xlsx"], 1.0, ["formulas"])])
+
+            def test_cluster_signatures_does_not_chain_components(self):
+                first = minhash_signature(np.arange(500, dtype=np.uint64))
+                second = minhash_signature(np.arange(10_000, 10_500, dtype=np.uint64))
+                third = minhash_signature(np.arange(20_000, 20_500, dtype=np.uint64))
+                clusters = cluster_signatures({"a.xlsx": {"formulas": first, "structure": second},
+                                               "b.xlsx": {"formulas": first.copy(), "structure": third},
+                                               "c.xlsx": {"formulas": second, "structure": third.copy()}})
+                self.assertEqual(sorted(clusters), [(["a.xlsx", "b.xlsx"], 1.0, ["formulas"]),
+                                                    (["b.xlsx", "c.xlsx"], 1.0, ["structure"])])
+
+            def test_same_data_different_structure_does_not_cluster(self):
+                layouts = {"a.xlsx": ("Sales", True, True, True), "a_copy.xlsx": ("Sales", True, True, True),
+                           "b.xlsx": ("Data", False, False), "c.xlsx": ("Music", True, False), "d.xlsx": ("Sheet1", False, True)}
+                self.assertEqual(self.cohort_clusters(layouts), [(["a.xlsx", "a_copy.xlsx"], 1.0, ["structure"])])
+
+            def test_shared_omission_does_not_cluster(self):
+                # 7 workbooks done as asked, 3 that each left out the table and the £ format on identical data.
+                layouts = {f"s{i}.xlsx": ("Sheet1", i < 7, i < 7) for i in range(10)}
+                self.assertEqual(self.cohort_clusters(layouts), [])
+
+            @staticmethod
+            def cohort_clusters(layouts):
+                def music_book(path, sheet_name, table, money, validated=False):
+                    wb = openpyxl.Workbook()
+                    ws = wb.active
+                    ws.title = sheet_name
+                    ws.append(["Year", "Album", "Artist", "Total Sales"])
+                    for i in range(450):
+                        ws.append([1960 + i % 60, "Greatest Hits" if i % 50 == 0 else f"Album {i}", f"Artist {i}", 1000 + i])
+                        if money:
+                            ws.cell(i + 2, 4).number_format = '"£"#,##0.00'
+                        if validated:
+                            ws.cell(i + 2, 1).number_format = "0"
+                    if table:
+                        ws.add_table(openpyxl.worksheet.table.Table(displayName="Music", ref="A1:D451"))
+                    if validated:
+                        ws.add_data_validation(openpyxl.worksheet.datavalidation.DataValidation(type="decimal", sqref="D2:D451"))
+                    wb.save(path)
+                with tempfile.TemporaryDirectory() as tmp:
+                    fingerprints = {}
+                    for name, layout in layouts.items():
+                        music_book(Path(tmp) / name, *layout)
+                        fingerprints[name] = workbook_fingerprint(Path(tmp) / name)
+                return cluster_fingerprints(fingerprints)
+
         unittest.main(argv=['first-arg-is-ignored'], exit=False)
+    elif len(sys.argv) > 2 and sys.argv[1] == 'cohort':
+        # Similarity report: python "python_code_version [ECA[2025-07-07]].py" cohort <folder> [threshold]
+        log_listener = setup_logging(json_lines=config.log_json,
+                                     level=getattr(logging, config.log_level, logging.DEBUG))
+        start_ts, run_id = log_startup(config)
+        threshold = float(sys.argv[3]) if len(sys.argv) > 3 else SIMILARITY_THRESHOLD
+        try:
+            clusters, skipped = find_similar_submissions(Path(sys.argv[2]), threshold)
+            if skipped:
+                print(f"Skipped (not a WP3 workbook or unreadable): {skipped}")
+            if not clusters:
+                print(f"No submissions above {threshold:.0%} similarity.")
+            for members, similarity, components in clusters:
+                print(f"{len(members)} similar workbooks (up to {similarity:.0%}, matching {'/'.join(components)}): "
+                      f"{', '.join(members)}")
+                logger.info("Similar cluster (%.2f, %s): %s", similarity, components, members)
+        finally:
+            log_shutdown(start_ts, run_id, sys.argv[2], [])
+            log_listener.stop()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        # Local grading service: python "python_code_version [ECA[2025-07-07]].py" serve [port] [workers]
+        log_listener = setup_logging(json_lines=config.log_json,
+                                     level=getattr(logging, config.log_level, logging.DEBUG))
+        start_ts, run_id = log_startup(config)
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else SERVICE_PORT
+        workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+        try:
+            run_service(port=port, workers=workers)
+        finally:
+            log_shutdown(start_ts, run_id, "service", [])
+            log_listener.stop()
     else:
         # Application run
         config = Config.load(Path("config_ECA.txt"))
+        log_listener = setup_logging(json_lines=config.log_json,
+                                     level=getattr(logging, config.log_level, logging.DEBUG))
         start_ts, run_id = log_startup(config)
         exit_code = 0
         try:
@@ -781,4 +1712,5 @@ if __name__=="__main__":
             path = getattr(app, 'path_var', '')
             messages = getattr(app, 'analysis_messages', [])
             code = log_shutdown(start_ts, run_id, path, messages, exit_code)
+            log_listener.stop() # flush queued records before the interpreter exits
             # sys.exit(code)